@@ -0,0 +1,343 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import websocket
+
+logger = logging.getLogger()
+
+
+# Raised if Kraken replied with an error while (re)synchronizing a feed
+class FeedError(Exception):
+    pass
+
+
+# Persistent WebSocket subscription that keeps some in-memory state up to date.
+# Subclasses define what to subscribe to, how to apply a message and how to
+# resynchronize the state over REST after a reconnect or a detected gap.
+class Feed:
+
+    def __init__(self, kraken, url, timeout=10, reconnect_time=5):
+        self.kraken = kraken
+        self.url = url
+        self.timeout = timeout
+        self.reconnect_time = reconnect_time
+        self.connected = False
+
+        self._listeners = list()
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+        self._ws = None
+
+    # Register a function that will be called on every change of the state
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    # Start listening to the feed in a background thread
+    def start(self):
+        if self._running:
+            return
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+        self._thread.start()
+
+    # Stop listening and close the connection
+    def stop(self):
+        self._running = False
+
+        # Interrupt a waiting 'recv', the feed thread closes the connection itself
+        ws = self._ws
+        if ws:
+            ws.abort()
+
+    def subscription(self):
+        raise NotImplementedError
+
+    def resync(self):
+        raise NotImplementedError
+
+    def apply(self, msg):
+        raise NotImplementedError
+
+    # Connect, subscribe and apply messages until stopped. Reconnect on errors
+    def _run(self):
+        while self._running:
+            try:
+                self._ws = websocket.create_connection(self.url, timeout=self.timeout)
+                self._ws.send(json.dumps(self.subscription()))
+
+                # Fetch everything that might have changed while we were not connected
+                self.resync()
+                self.connected = True
+                logger.debug("Feed connected: " + self.url)
+
+                idle = False
+                while self._running:
+                    try:
+                        raw_msg = self._ws.recv()
+                    except websocket.WebSocketTimeoutException:
+                        # Connection is silent for two timeouts in a row: reconnect
+                        if idle:
+                            raise
+                        idle = True
+                        self._ws.send(json.dumps({"event": "ping"}))
+                        continue
+
+                    idle = False
+                    if raw_msg:
+                        self._handle(json.loads(raw_msg))
+            except (websocket.WebSocketException, OSError, ValueError, FeedError) as e:
+                if self._running:
+                    logger.warning("Feed disconnected: " + self.url + " (" + str(e) + ")")
+            # Anything else (unexpected message, HTTP error of the REST API) must not end the feed
+            except Exception:
+                if self._running:
+                    logger.exception("Feed failed: " + self.url)
+            finally:
+                self.connected = False
+                self._close()
+
+            if self._running:
+                time.sleep(self.reconnect_time)
+
+    # Handle events here and pass data messages on to the subclass
+    def _handle(self, msg):
+        if isinstance(msg, dict):
+            if msg.get("status") == "error":
+                self.error(msg)
+            return
+
+        self.apply(msg)
+
+    # Kraken rejected a request, for example the subscription of a single pair
+    def error(self, msg):
+        logger.warning("Feed error: " + str(msg.get("errorMessage")))
+
+    def _close(self):
+        ws, self._ws = self._ws, None
+        if ws:
+            try:
+                ws.close()
+            except (websocket.WebSocketException, OSError):
+                pass
+
+    def _notify(self, *args):
+        for listener in self._listeners:
+            try:
+                listener(*args)
+            except Exception:
+                logger.exception("Feed listener failed")
+
+
+# Last trade prices of all pairs that trade against 'trade_to_currency'
+class TickerFeed(Feed):
+
+    def __init__(self, kraken, url, trade_to_currency, **kwargs):
+        super().__init__(kraken, url, **kwargs)
+        self.trade_to_currency = trade_to_currency
+
+        # Pair name of the WebSocket API (for example 'XBT/EUR') -> pair name of the REST API ('XXBTZEUR')
+        self.pairs = dict()
+        # Pair name of the REST API -> traded asset (for example 'XXBT') and the other way round
+        self.assets = dict()
+        self.asset_pairs = dict()
+        # Pair name of the REST API -> last trade price
+        self.tickers = dict()
+
+    # Return last trade prices for the given pairs, if known by the live feed
+    def prices(self, pairs):
+        if not self.connected:
+            return dict()
+
+        with self._lock:
+            return {pair: self.tickers[pair] for pair in pairs if pair in self.tickers}
+
+    # Load the known pairs over REST if not done yet, also while the WebSocket is unreachable.
+    # Returns False if that's not possible right now (it will be retried with the next call)
+    def load_pairs(self):
+        if self.pairs:
+            return True
+
+        try:
+            self._load_pairs()
+        except Exception:
+            logger.exception("Loading asset pairs failed")
+            return False
+
+        return True
+
+    # Return traded asset of a pair of the REST API, if known
+    def asset_of(self, pair_name):
+        with self._lock:
+            return self.assets.get(pair_name)
+
+    # Return pair of the REST API that trades the given asset, if known
+    def pair_of(self, asset):
+        with self._lock:
+            return self.asset_pairs.get(asset)
+
+    def subscription(self):
+        if not self.pairs:
+            self._load_pairs()
+
+        return {"event": "subscribe", "pair": list(self.pairs), "subscription": {"name": "ticker"}}
+
+    def resync(self):
+        res_data = self.kraken.query_public("Ticker", {"pair": ",".join(self.pairs.values())})
+
+        if res_data["error"]:
+            raise FeedError(res_data["error"][0])
+
+        for pair_name, pair_data in res_data["result"].items():
+            self._set_price(pair_name, pair_data["c"][0])
+
+    # Ticker messages look like [channel_id, {'c': [price, volume], ...}, 'ticker', 'XBT/EUR']
+    def apply(self, msg):
+        if len(msg) < 4 or msg[-2] != "ticker":
+            return
+
+        pair_name = self.pairs.get(msg[-1])
+        if pair_name and "c" in msg[1]:
+            self._set_price(pair_name, msg[1]["c"][0])
+
+    def _set_price(self, pair_name, last_trade_price):
+        with self._lock:
+            if self.tickers.get(pair_name) == last_trade_price:
+                return
+            self.tickers[pair_name] = last_trade_price
+
+        self._notify(pair_name, last_trade_price)
+
+    def _load_pairs(self):
+        res_data = self.kraken.query_public("AssetPairs")
+
+        if res_data["error"]:
+            raise FeedError(res_data["error"][0])
+
+        with self._lock:
+            for pair_name, pair_info in res_data["result"].items():
+                # Skip dark pool pairs, they have no own ticker
+                if pair_name.endswith(".d") or "wsname" not in pair_info:
+                    continue
+                if pair_info["quote"] == "Z" + self.trade_to_currency:
+                    self.pairs[pair_info["wsname"]] = pair_name
+                    self.assets[pair_name] = pair_info["base"]
+                    self.asset_pairs[pair_info["base"]] = pair_name
+
+
+# Own open orders. Listeners get notified once an order is closed, canceled or expired
+class OrderFeed(Feed):
+
+    FINAL_STATUS = ("closed", "canceled", "expired")
+
+    # Number of finished orders to remember, to ignore repeated updates of them
+    MAX_FINISHED = 1000
+
+    def __init__(self, kraken, url, **kwargs):
+        super().__init__(kraken, url, **kwargs)
+
+        # TXID -> order info
+        self.orders = dict()
+
+        # TXIDs of finished orders, oldest first
+        self._finished = OrderedDict()
+        self._sequence = None
+
+    # Add an order that was just created, so that we know it even if its first update gets lost
+    def track(self, txid, order_info):
+        # Order got executed (or canceled) right away: notify instead of waiting for an update
+        if order_info.get("status") in self.FINAL_STATUS:
+            self._update_order(txid, order_info)
+            return
+
+        with self._lock:
+            if txid not in self.orders:
+                self.orders[txid] = order_info
+
+    def subscription(self):
+        res_data = self.kraken.query_private("GetWebSocketsToken")
+
+        if res_data["error"]:
+            raise FeedError(res_data["error"][0])
+
+        # Sequence numbers start again with every new subscription
+        self._sequence = None
+
+        return {"event": "subscribe", "subscription": {"name": "openOrders", "token": res_data["result"]["token"]}}
+
+    # Without subscription no order updates arrive, so reconnect with a new token
+    def error(self, msg):
+        raise FeedError(msg.get("errorMessage"))
+
+    def resync(self):
+        res_data = self.kraken.query_private("OpenOrders")
+
+        if res_data["error"]:
+            raise FeedError(res_data["error"][0])
+
+        open_orders = res_data["result"]["open"]
+
+        with self._lock:
+            vanished = [txid for txid in self.orders if txid not in open_orders]
+
+        # Orders that are not open anymore changed their status while we weren't listening
+        if vanished:
+            res_data = self.kraken.query_private("QueryOrders", {"txid": ",".join(vanished)})
+
+            if res_data["error"]:
+                raise FeedError(res_data["error"][0])
+
+            for txid, order_info in res_data["result"].items():
+                self._update_order(txid, order_info)
+
+        for txid, order_info in open_orders.items():
+            self._update_order(txid, order_info)
+
+    # Order messages look like [[{txid: {...}}, ...], 'openOrders', {'sequence': n}]
+    def apply(self, msg):
+        if len(msg) < 2 or msg[1] != "openOrders":
+            return
+
+        # A missing sequence number means that we lost an update
+        if len(msg) > 2 and "sequence" in msg[2]:
+            sequence = msg[2]["sequence"]
+            gap = self._sequence is not None and sequence != self._sequence + 1
+            self._sequence = sequence
+
+            if gap:
+                logger.warning("Gap in order feed, resynchronizing")
+                self.resync()
+                return
+
+        for order_update in msg[0]:
+            for txid, order_info in order_update.items():
+                self._update_order(txid, order_info)
+
+    # Merge (partial) order info into the known state
+    def _update_order(self, txid, order_info):
+        with self._lock:
+            # Order already reached its final status
+            if txid in self._finished:
+                return
+
+            known_info = self.orders.get(txid, dict())
+            old_status = known_info.get("status")
+
+            new_info = dict(known_info)
+            new_info.update(order_info)
+
+            if new_info.get("status") in self.FINAL_STATUS:
+                self.orders.pop(txid, None)
+                self._finished[txid] = True
+
+                if len(self._finished) > self.MAX_FINISHED:
+                    self._finished.popitem(last=False)
+            else:
+                self.orders[txid] = new_info
+
+        if new_info.get("status") in self.FINAL_STATUS and new_info.get("status") != old_status:
+            self._notify(txid, new_info)
@@ -9,7 +9,10 @@ import time
 import krakenex
 import requests
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Updater, CommandHandler, Job, CallbackQueryHandler
+from telegram.ext import Updater, CommandHandler, CallbackQueryHandler
+
+from feed import TickerFeed, OrderFeed
+from valuation import Valuation
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -24,12 +27,18 @@ with open("config.json") as config_file:
 kraken = krakenex.API()
 kraken.load_key("kraken.key")
 
+# Live ticker and order state from Kraken's WebSocket API
+ticker_feed = TickerFeed(kraken, config["websocket_url"], config["trade_to_currency"], timeout=config["websocket_timeout"])
+order_feed = OrderFeed(kraken, config["websocket_auth_url"], timeout=config["websocket_timeout"])
+
+# Balance and value of all assets, kept up to date by the feeds
+valuation = Valuation(config["trade_to_currency"])
+
 # Set bot token
 updater = Updater(token=config["bot_token"])
 
-# Get dispatcher and job queue
+# Get dispatcher
 dispatcher = updater.dispatcher
-job_queue = updater.job_queue
 
 
 # Create a button menu to show in Telegram messages
@@ -44,61 +53,75 @@ def build_menu(buttons, n_cols, header_buttons, footer_buttons):
     return menu
 
 
-# Check order status and send message if changed
-def monitor_order(bot, job):
-    req_data = dict()
-    req_data["txid"] = job.context["order_txid"]
+# Update balance and send message if a monitored order was executed
+def order_changed(order_txid, order_info):
+    # Executed trade changed the balance, also if the order was canceled or expired after a partial fill
+    if order_info["status"] == "closed" or float(order_info.get("vol_exec", 0)) > 0:
+        load_balance()
 
-    # Send request to get info on specific order
-    res_data = kraken.query_private("QueryOrders", req_data)
-
-    # If Kraken replied with an error, show it
-    if res_data["error"]:
-        bot.send_message(job.context["chat_id"], text=res_data["error"][0])
-        # Stop this job
-        job.schedule_removal()
+    if order_info["status"] != "closed":
         return
 
-    # Save information about order
-    order_info = res_data["result"][job.context["order_txid"]]
+    if config["check_trade"].lower() == "true":
+        msg = "Trade executed: " + order_txid
 
-    # Check if order was canceled. If so, stop monitoring
-    if order_info["status"] == "canceled":
-        # Stop this job
-        job.schedule_removal()
+        # Status-only updates of orders we didn't know before have no description
+        if "descr" not in order_info:
+            req_data = dict()
+            req_data["txid"] = order_txid
 
-    # Check if trade was executed. If so, stop monitoring and send message
-    elif order_info["status"] == "closed":
-        msg = "Trade executed: " + job.context["order_txid"] + "\n" + trim_zeros(order_info["descr"]["order"])
-        bot.send_message(chat_id=job.context["chat_id"], text=msg)
-        # Stop this job
-        job.schedule_removal()
+            # Send request to get info on specific order
+            res_data = kraken.query_private("QueryOrders", req_data)
 
+            if not res_data["error"] and order_txid in res_data["result"]:
+                order_info = res_data["result"][order_txid]
 
-# Monitor status changes of open orders
-def monitor_open_orders():
-    if config["check_trade"].lower() == "true":
-        # Send request for open orders to Kraken
-        res_data = kraken.query_private("OpenOrders")
+        if "descr" in order_info:
+            msg += "\n" + trim_zeros(order_info["descr"]["order"])
 
-        # If Kraken replied with an error, show it
-        if res_data["error"]:
-            updater.bot.send_message(chat_id=config["user_id"], text=res_data["error"][0])
-            return
+        updater.bot.send_message(chat_id=config["user_id"], text=msg)
 
-        # Get time in seconds from config
-        check_trade_time = config["check_trade_time"]
 
-        if res_data["result"]["open"]:
-            for order in res_data["result"]["open"]:
-                order_txid = str(order)
+# Update value of traded asset if its price changed
+def price_changed(pair_name, last_trade_price):
+    asset = ticker_feed.asset_of(pair_name)
+
+    if asset:
+        valuation.update_price(asset, last_trade_price)
+
+
+# Load balance of all currencies into valuation
+def load_balance():
+    # Send request to Kraken to get current balance of all currencies
+    res_data = kraken.query_private("Balance")
+
+    if not res_data["error"]:
+        valuation.set_positions(res_data["result"])
+
+    return res_data
+
 
-                # Create context object with chat ID and order TXID
-                context_data = dict(chat_id=config["user_id"], order_txid=order_txid)
+# Get last trade prices for currency pairs. Prices not known by the live feed are requested from Kraken
+def get_prices(pairs):
+    res_data = dict(error=[], result=ticker_feed.prices(pairs))
+
+    missing_pairs = [pair for pair in pairs if pair not in res_data["result"]]
+
+    if missing_pairs:
+        req_data = dict()
+        req_data["pair"] = ",".join(missing_pairs)
 
-                # Create job to check status of order
-                job_check_order = Job(monitor_order, check_trade_time, context=context_data)
-                job_queue.put(job_check_order, next_t=0.0)
+        # Send request to Kraken to get current trading price for currency-pair
+        res_data_ticker = kraken.query_public("Ticker", req_data)
+
+        # If Kraken replied with an error, return it
+        if res_data_ticker["error"]:
+            return res_data_ticker
+
+        for pair_name, pair_data in res_data_ticker["result"].items():
+            res_data["result"][pair_name] = pair_data["c"][0]
+
+    return res_data
 
 
 # Remove trailing zeros to get clean values
@@ -132,7 +155,7 @@ def balance(bot, update):
     # Command without arguments
     if len(msg_params) == 1:
         # Send request to Kraken to get current balance of all currencies
-        res_data = kraken.query_private("Balance")
+        res_data = load_balance()
 
     # Command with argument 'available'
     elif len(msg_params) == 2 and msg_params[1] == "available":
@@ -265,15 +288,8 @@ def trade(bot, update):
             order_desc = res_data_query_order["result"][add_order_txid]["descr"]["order"]
             bot.send_message(chat_id, text="Order placed: " + add_order_txid + "\n" + trim_zeros(order_desc))
 
-            if config["check_trade"].lower() == "true":
-                # Get time in seconds from config
-                check_trade_time = config["check_trade_time"]
-                # Create context object with chat ID and order TXID
-                context_data = dict(chat_id=update.message.chat_id, order_txid=add_order_txid)
-
-                # Create job to check status of newly created order
-                job_check_order = Job(monitor_order, check_trade_time, context=context_data)
-                job_queue.put(job_check_order, next_t=0.0)
+            # Let the order feed know about the new order so that it gets monitored
+            order_feed.track(add_order_txid, res_data_query_order["result"][add_order_txid])
             return
         else:
             bot.send_message(chat_id, text="No order with TXID " + add_order_txid)
@@ -403,22 +419,11 @@ def price(bot, update):
         bot.send_message(chat_id, text="Syntax: /price [currency] ([currency] ...)")
         return
 
-    req_data = dict()
-    req_data["pair"] = ""
-
-    # Loop over all parameters (except first) and add them as currencies to request
-    first = True
-    for param in msg_params:
-        if first:
-            first = False
-        else:
-            req_data["pair"] += param + "Z" + config["trade_to_currency"] + ","
-
-    # Remove last comma from 'pair' string
-    req_data["pair"] = req_data["pair"][:-1]
+    # Add all parameters (except first) as currencies to request
+    pairs = [param + "Z" + config["trade_to_currency"] for param in msg_params[1:]]
 
-    # Send request to Kraken to get current trading price for currency-pair
-    res_data = kraken.query_public("Ticker", req_data)
+    # Get current trading price for currency-pairs
+    res_data = get_prices(pairs)
 
     # If Kraken replied with an error, show it
     if res_data["error"]:
@@ -429,11 +434,9 @@ def price(bot, update):
     for currency_key, currency_value in res_data["result"].items():
         # Set currency without 'trade to currency' value (for example 'ZEUR')
         currency = currency_key[:-len("Z" + config["trade_to_currency"])]
-        # Read last trade price
-        last_trade_price = currency_value["c"][0]
 
-        # Remove zeros at the end
-        last_trade_price = trim_zeros(last_trade_price)
+        # Remove zeros at the end of last trade price
+        last_trade_price = trim_zeros(currency_value)
 
         #  Add currency to price
         last_trade_price += " " + config["trade_to_currency"]
@@ -444,7 +447,7 @@ def price(bot, update):
     bot.send_message(chat_id, text=msg)
 
 
-# Show the current real money value for all assets combined
+# Show the current real money value of every asset and for all assets combined
 def value(bot, update):
     chat_id = get_chat_id(update)
 
@@ -456,55 +459,70 @@ def value(bot, update):
     # Save message parameters in list
     msg_params = update.message.text.split(" ")
 
-    # Send request to Kraken to get current balance of all currencies
-    res_data_balance = kraken.query_private("Balance")
+    # Balance is updated on every executed trade. Other changes (deposits, fees, ...) need a reload from time to time
+    if not valuation.is_ready(max_age=config["balance_refresh_time"]):
+        res_data_balance = load_balance()
 
-    # If Kraken replied with an error, show it
-    if res_data_balance["error"]:
-        bot.send_message(chat_id, text=res_data_balance["error"][0])
-        return
+        # If Kraken replied with an error, show it
+        if res_data_balance["error"]:
+            bot.send_message(chat_id, text=res_data_balance["error"][0])
+            return
 
-    curr_str = "Overall: "
+    # Prices are only kept up to date while the live feed is connected. Otherwise request all of them
+    if ticker_feed.connected:
+        assets = valuation.unpriced_assets()
+    else:
+        assets = valuation.held_assets()
 
-    req_data_price = dict()
-    req_data_price["pair"] = ""
+    # Pairs have to be known even if the live feed never connected
+    ticker_feed.load_pairs()
 
-    for currency_name, currency_amount in res_data_balance["result"].items():
-        if currency_name.endswith(config["trade_to_currency"]):
-            continue
+    pairs = [ticker_feed.pair_of(asset) for asset in assets]
+    pairs = [pair for pair in pairs if pair]
 
-        if (len(msg_params) == 2) and (currency_name == msg_params[1].upper()):
-            req_data_price["pair"] = currency_name + "Z" + config["trade_to_currency"] + ","
-            curr_str = msg_params[1].upper() + ": "
-            break
+    if pairs:
+        res_data_price = get_prices(pairs)
 
-        req_data_price["pair"] += currency_name + "Z" + config["trade_to_currency"] + ","
+        # If Kraken replied with an error, show it
+        if res_data_price["error"]:
+            bot.send_message(chat_id, text=res_data_price["error"][0])
+            return
 
-    # Remove last comma from 'pair' string
-    req_data_price["pair"] = req_data_price["pair"][:-1]
+        for pair_name, last_trade_price in res_data_price["result"].items():
+            price_changed(pair_name, last_trade_price)
 
-    # Send request to Kraken to get current trading price for currency-pair
-    res_data_price = kraken.query_public("Ticker", req_data_price)
+    # Only the overview of all assets is a new base for the change of values
+    breakdown, total_value, total_change = valuation.snapshot(commit=len(msg_params) == 1)
 
-    # If Kraken replied with an error, show it
-    if res_data_price["error"]:
-        bot.send_message(chat_id, text=res_data_price["error"][0])
-        return
+    msg = ""
 
-    total_value_euro = float(0)
+    for asset, amount, asset_value, allocation, change in breakdown:
+        # Show only the requested currency
+        if len(msg_params) == 2 and asset != msg_params[1].upper():
+            continue
 
-    for currency_pair_name, currency_price in res_data_price["result"].items():
-        # Remove trade-to-currency from currency pair to get the pure currency
-        currency_without_pair = currency_pair_name[:-len("Z" + config["trade_to_currency"])]
-        currency_balance = res_data_balance["result"][currency_without_pair]
+        msg += asset + ": " + trim_zeros(amount)
 
-        # Calculate total value by multiplying currency asset with last trade price
-        total_value_euro += float(currency_balance) * float(currency_price["c"][0])
+        if asset_value is None:
+            msg += " (no price)\n"
+            continue
+
+        # Show only 2 digits after decimal place
+        msg += " = " + "{0:.2f}".format(asset_value) + " " + config["trade_to_currency"]
+        msg += " (" + "{0:.2f}".format(allocation) + "%"
+        if change is not None:
+            msg += ", " + "{0:+.2f}".format(change)
+        msg += ")\n"
+
+    if len(msg_params) == 1:
+        msg += "Overall: " + "{0:.2f}".format(total_value) + " " + config["trade_to_currency"]
+        if total_change is not None:
+            msg += " (" + "{0:+.2f}".format(total_change) + ")"
 
-    # Show only 2 digits after decimal place
-    total_value_euro = "{0:.2f}".format(total_value_euro)
+    if not msg:
+        msg = "No balance for " + msg_params[1].upper()
 
-    bot.send_message(chat_id, text=curr_str + total_value_euro + " " + config["trade_to_currency"])
+    bot.send_message(chat_id, text=msg)
 
 
 # Check if GitHub hosts a different script then the current one
@@ -657,5 +675,12 @@ updater.start_polling()
 # Check if script is the newest version
 check_for_update()
 
-# Monitor status changes of open orders
-monitor_open_orders()
+# Load balance and pairs to be able to value assets
+load_balance()
+ticker_feed.load_pairs()
+
+# Monitor prices and status changes of open orders
+ticker_feed.add_listener(price_changed)
+order_feed.add_listener(order_changed)
+ticker_feed.start()
+order_feed.start()
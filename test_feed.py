@@ -0,0 +1,275 @@
+import base64
+import hashlib
+import json
+import socket
+import struct
+import threading
+import time
+import unittest
+
+from feed import TickerFeed, OrderFeed
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+# Minimal local stand-in for Kraken's WebSocket API. Records every message of
+# the client and sends whatever the test wants to the current connection
+class LocalWebSocketServer:
+
+    def __init__(self):
+        self.received = list()
+        self.connections = 0
+
+        self._conn = None
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(("127.0.0.1", 0))
+        self._sock.listen(5)
+        self.url = "ws://127.0.0.1:" + str(self._sock.getsockname()[1])
+
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def send(self, msg):
+        payload = json.dumps(msg).encode()
+
+        if len(payload) < 126:
+            header = struct.pack("!BB", 0x81, len(payload))
+        else:
+            header = struct.pack("!BBH", 0x81, 126, len(payload))
+
+        self._conn.sendall(header + payload)
+
+    # Close the current connection without a closing handshake
+    def drop(self):
+        conn, self._conn = self._conn, None
+        conn.shutdown(socket.SHUT_RDWR)
+        conn.close()
+
+    def close(self):
+        if self._conn:
+            self.drop()
+        self._sock.close()
+
+    def subscriptions(self):
+        return [msg for msg in self.received if msg.get("event") == "subscribe"]
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+
+            request = b""
+            while b"\r\n\r\n" not in request:
+                request += conn.recv(1024)
+
+            key = ""
+            for line in request.decode().split("\r\n"):
+                if line.lower().startswith("sec-websocket-key:"):
+                    key = line.split(":", 1)[1].strip()
+
+            accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+            conn.sendall(("HTTP/1.1 101 Switching Protocols\r\n"
+                          "Upgrade: websocket\r\n"
+                          "Connection: Upgrade\r\n"
+                          "Sec-WebSocket-Accept: " + accept + "\r\n\r\n").encode())
+
+            self._conn = conn
+            self.connections += 1
+            threading.Thread(target=self._read, args=(conn,), daemon=True).start()
+
+    # Read masked text frames of the client
+    def _read(self, conn):
+        try:
+            while True:
+                opcode, length = struct.unpack("!BB", self._recv(conn, 2))
+                length &= 0x7f
+                if length == 126:
+                    length = struct.unpack("!H", self._recv(conn, 2))[0]
+                elif length == 127:
+                    length = struct.unpack("!Q", self._recv(conn, 8))[0]
+
+                mask = self._recv(conn, 4)
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(self._recv(conn, length)))
+
+                if opcode & 0x0f == 0x1:
+                    self.received.append(json.loads(payload.decode()))
+                elif opcode & 0x0f == 0x8:
+                    # Answer closing handshake
+                    conn.sendall(struct.pack("!BB", 0x88, 0))
+                    return
+        except OSError:
+            return
+
+    @staticmethod
+    def _recv(conn, size):
+        data = b""
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                raise OSError("Connection closed")
+            data += chunk
+        return data
+
+
+# Replaces krakenex.API and answers REST requests with prepared results
+class StubKraken:
+
+    def __init__(self, results):
+        self.results = results
+        self.calls = list()
+
+    def query_public(self, method, req_data=None):
+        return self._query(method, req_data)
+
+    def query_private(self, method, req_data=None):
+        return self._query(method, req_data)
+
+    def _query(self, method, req_data):
+        self.calls.append((method, req_data))
+        return dict(error=[], result=self.results[method])
+
+
+def wait_for(condition, timeout=5):
+    end = time.time() + timeout
+    while time.time() < end:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class TickerFeedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalWebSocketServer()
+        self.kraken = StubKraken({
+            "AssetPairs": {
+                "XXBTZEUR": {"wsname": "XBT/EUR", "base": "XXBT", "quote": "ZEUR"},
+                "XXBTZEUR.d": {"base": "XXBT", "quote": "ZEUR"},
+                "XXBTZUSD": {"wsname": "XBT/USD", "base": "XXBT", "quote": "ZUSD"}},
+            "Ticker": {"XXBTZEUR": {"c": ["100.0", "1"]}}})
+
+        self.feed = TickerFeed(self.kraken, self.server.url, "EUR", timeout=1, reconnect_time=0.1)
+        self.changes = list()
+        self.feed.add_listener(lambda *args: self.changes.append(args))
+        self.feed.start()
+
+        self.assertTrue(wait_for(lambda: self.feed.connected))
+
+    def tearDown(self):
+        self.feed.stop()
+        self.server.close()
+
+    def test_snapshot_and_price_update(self):
+        self.assertEqual(self.server.subscriptions()[0]["pair"], ["XBT/EUR"])
+        self.assertEqual(self.feed.prices(["XXBTZEUR"]), {"XXBTZEUR": "100.0"})
+        self.assertEqual(self.feed.pair_of("XXBT"), "XXBTZEUR")
+        self.assertEqual(self.feed.asset_of("XXBTZEUR"), "XXBT")
+
+        self.server.send([42, {"c": ["101.5", "0.1"]}, "ticker", "XBT/EUR"])
+
+        self.assertTrue(wait_for(lambda: self.feed.prices(["XXBTZEUR"]) == {"XXBTZEUR": "101.5"}))
+        self.assertEqual(self.changes, [("XXBTZEUR", "100.0"), ("XXBTZEUR", "101.5")])
+
+    def test_reconnect_and_resync_after_drop(self):
+        self.kraken.results["Ticker"] = {"XXBTZEUR": {"c": ["105.0", "1"]}}
+        self.server.drop()
+
+        self.assertTrue(wait_for(lambda: len(self.server.subscriptions()) == 2))
+        self.assertTrue(wait_for(lambda: self.feed.prices(["XXBTZEUR"]) == {"XXBTZEUR": "105.0"}))
+        self.assertEqual(self.server.connections, 2)
+
+    def test_unexpected_message_does_not_end_feed(self):
+        self.server.send([42, {"c": []}, "ticker", "XBT/EUR"])
+
+        self.assertTrue(wait_for(lambda: len(self.server.subscriptions()) == 2))
+        self.assertTrue(wait_for(lambda: self.feed.connected))
+
+    def test_load_pairs_without_websocket(self):
+        feed = TickerFeed(self.kraken, "ws://127.0.0.1:1", "EUR")
+
+        self.assertIsNone(feed.pair_of("XXBT"))
+        self.assertTrue(feed.load_pairs())
+        self.assertEqual(feed.pair_of("XXBT"), "XXBTZEUR")
+        self.assertEqual(feed.asset_of("XXBTZEUR"), "XXBT")
+
+
+class OrderFeedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalWebSocketServer()
+        self.kraken = StubKraken({
+            "GetWebSocketsToken": {"token": "some_token"},
+            "OpenOrders": {"open": {"A": {"status": "open", "descr": {"order": "buy 1 XBTEUR @ limit 100"}}}},
+            "QueryOrders": {"A": {"status": "closed", "descr": {"order": "buy 1 XBTEUR @ limit 100"}}}})
+
+        self.feed = OrderFeed(self.kraken, self.server.url, timeout=1, reconnect_time=0.1)
+        self.changes = list()
+        self.feed.add_listener(lambda *args: self.changes.append(args))
+        self.feed.start()
+
+        self.assertTrue(wait_for(lambda: self.feed.connected))
+
+    def tearDown(self):
+        self.feed.stop()
+        self.server.close()
+
+    def test_snapshot_and_order_update(self):
+        self.assertEqual(self.server.subscriptions()[0]["subscription"]["token"], "some_token")
+        self.assertEqual(list(self.feed.orders), ["A"])
+
+        self.server.send([[{"A": {"status": "closed"}}], "openOrders", {"sequence": 1}])
+
+        self.assertTrue(wait_for(lambda: self.changes))
+        self.assertEqual(self.changes[0][0], "A")
+        self.assertEqual(self.changes[0][1]["status"], "closed")
+        self.assertEqual(self.changes[0][1]["descr"]["order"], "buy 1 XBTEUR @ limit 100")
+        self.assertEqual(self.feed.orders, {})
+
+    def test_gap_in_sequence_triggers_resync(self):
+        self.server.send([[{"B": {"status": "open"}}], "openOrders", {"sequence": 1}])
+        self.assertTrue(wait_for(lambda: "B" in self.feed.orders))
+
+        # Order 'A' got executed in the lost update with sequence 2
+        self.kraken.results["OpenOrders"] = {"open": {"B": {"status": "open"}}}
+        self.server.send([[{"C": {"status": "open"}}], "openOrders", {"sequence": 3}])
+
+        self.assertTrue(wait_for(lambda: self.changes))
+        self.assertEqual(self.changes[0][0], "A")
+        self.assertEqual(self.changes[0][1]["status"], "closed")
+        self.assertIn(("QueryOrders", {"txid": "A"}), self.kraken.calls)
+        self.assertEqual([call[0] for call in self.kraken.calls].count("OpenOrders"), 2)
+
+    def test_track_executed_order(self):
+        # Market order that was already executed when the bot asked for it
+        self.feed.track("T", {"status": "closed", "descr": {"order": "buy 1 XBTEUR @ market"}})
+
+        self.assertEqual(len(self.changes), 1)
+        self.assertEqual(self.changes[0][0], "T")
+
+        # Update of the feed for the same order doesn't notify again
+        self.server.send([[{"T": {"status": "closed"}}], "openOrders", {"sequence": 1}])
+        self.server.send([[{"D": {"status": "open"}}], "openOrders", {"sequence": 2}])
+
+        self.assertTrue(wait_for(lambda: "D" in self.feed.orders))
+        self.assertEqual(len(self.changes), 1)
+
+    def test_rejected_subscription_reconnects(self):
+        self.server.send({"event": "subscriptionStatus", "status": "error", "errorMessage": "EAPI:Invalid token"})
+
+        self.assertTrue(wait_for(lambda: len(self.server.subscriptions()) == 2))
+        self.assertEqual([call[0] for call in self.kraken.calls].count("GetWebSocketsToken"), 2)
+
+    def test_finished_orders_are_limited(self):
+        self.feed.MAX_FINISHED = 2
+
+        for txid in ("T1", "T2", "T3"):
+            self.feed.track(txid, {"status": "canceled"})
+
+        self.assertEqual(list(self.feed._finished), ["T2", "T3"])
+
+
+if __name__ == "__main__":
+    unittest.main()
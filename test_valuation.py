@@ -0,0 +1,109 @@
+import random
+import unittest
+
+from valuation import Valuation
+
+
+class ValuationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.valuation = Valuation("EUR")
+
+    def test_not_ready_before_balance(self):
+        self.assertFalse(self.valuation.is_ready())
+
+        self.valuation.set_positions({"ZEUR": "10"})
+
+        self.assertTrue(self.valuation.is_ready())
+        self.assertTrue(self.valuation.is_ready(max_age=60))
+        self.assertFalse(self.valuation.is_ready(max_age=-1))
+
+    def test_trade_to_currency_counts_at_price_one(self):
+        self.valuation.set_positions({"ZEUR": "50.5"})
+
+        self.assertEqual(self.valuation.total, 50.5)
+        self.assertEqual(self.valuation.unpriced_assets(), [])
+
+    def test_incremental_total(self):
+        self.valuation.update_price("XXBT", "100")
+        self.valuation.set_positions({"XXBT": "2", "ZEUR": "50", "KFEE": "10"})
+
+        self.assertEqual(self.valuation.total, 250.0)
+        self.assertEqual(self.valuation.unpriced_assets(), ["KFEE"])
+
+        self.valuation.update_price("XXBT", "110")
+        self.assertEqual(self.valuation.total, 270.0)
+
+        # Price of an asset without balance doesn't change the total
+        self.valuation.update_price("XETH", "20")
+        self.assertEqual(self.valuation.total, 270.0)
+
+    def test_total_matches_sum_of_values(self):
+        assets = ["A" + str(i) for i in range(300)]
+        rnd = random.Random(0)
+
+        for _ in range(5):
+            self.valuation.set_positions({asset: str(rnd.uniform(0, 10)) for asset in rnd.sample(assets, 200)})
+
+            for _ in range(2000):
+                self.valuation.update_price(rnd.choice(assets), str(rnd.uniform(0.01, 1000)))
+
+            self.assertAlmostEqual(self.valuation.total, sum(self.valuation.values.values()), places=6)
+
+    def test_set_positions_removes_vanished_assets(self):
+        self.valuation.update_price("XXBT", "100")
+        self.valuation.update_price("XETH", "10")
+        self.valuation.set_positions({"XXBT": "1", "XETH": "2"})
+
+        self.valuation.set_positions({"XXBT": "1", "XETH": "0"})
+
+        self.assertEqual(self.valuation.held_assets(), ["XXBT"])
+        self.assertEqual(self.valuation.values, {"XXBT": 100.0})
+        self.assertEqual(self.valuation.total, 100.0)
+
+        self.valuation.set_positions({"ZEUR": "5"})
+
+        self.assertEqual(self.valuation.held_assets(), ["ZEUR"])
+        self.assertEqual(self.valuation.total, 5.0)
+
+    def test_snapshot_allocation_change_and_order(self):
+        self.valuation.update_price("XXBT", "100")
+        self.valuation.update_price("XETH", "10")
+        self.valuation.set_positions({"XXBT": "1", "XETH": "3", "ZEUR": "70", "KFEE": "10"})
+
+        breakdown, total, total_change = self.valuation.snapshot()
+
+        self.assertEqual([item[0] for item in breakdown], ["XXBT", "ZEUR", "XETH", "KFEE"])
+        self.assertEqual(breakdown[-1], ("KFEE", 10.0, None, None, None))
+        self.assertEqual(total, 200.0)
+        self.assertIsNone(total_change)
+        self.assertIsNone(breakdown[0][4])
+        self.assertAlmostEqual(sum(item[3] for item in breakdown if item[3] is not None), 100.0)
+        self.assertAlmostEqual(breakdown[0][3], 50.0)
+
+        self.valuation.update_price("XXBT", "130")
+        self.valuation.set_positions({"XXBT": "1", "ZEUR": "100", "KFEE": "10"})
+
+        breakdown, total, total_change = self.valuation.snapshot()
+        changes = {item[0]: item[4] for item in breakdown}
+
+        self.assertEqual(total, 230.0)
+        self.assertAlmostEqual(total_change, 30.0)
+        self.assertAlmostEqual(changes["XXBT"], 30.0)
+        self.assertAlmostEqual(changes["ZEUR"], 30.0)
+        self.assertNotIn("XETH", changes)
+
+    def test_snapshot_without_commit_keeps_base(self):
+        self.valuation.update_price("XXBT", "100")
+        self.valuation.set_positions({"XXBT": "1"})
+        self.valuation.snapshot()
+
+        self.valuation.update_price("XXBT", "120")
+        self.assertAlmostEqual(self.valuation.snapshot(commit=False)[2], 20.0)
+
+        self.valuation.update_price("XXBT", "150")
+        self.assertAlmostEqual(self.valuation.snapshot()[2], 50.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
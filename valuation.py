@@ -0,0 +1,111 @@
+import threading
+import time
+
+
+# Keeps balance and price of every asset in memory and updates the total value
+# incrementally on every change, so that the current value is always known
+class Valuation:
+
+    def __init__(self, trade_to_currency):
+        self.trade_to_currency = trade_to_currency
+
+        # Asset -> amount
+        self.positions = dict()
+        # Asset -> last trade price in 'trade_to_currency'
+        self.prices = {"Z" + trade_to_currency: 1.0}
+        # Asset -> value in 'trade_to_currency' (only assets with known price)
+        self.values = dict()
+        # Sum of all values
+        self.total = 0.0
+
+        # Values and total of the last snapshot, to show the change since then
+        self.last_values = None
+        self.last_total = None
+
+        # Time of last balance update
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    # True if balances are known and, if 'max_age' is given, not older than that many seconds
+    def is_ready(self, max_age=None):
+        if self._loaded_at is None:
+            return False
+
+        return max_age is None or time.time() - self._loaded_at <= max_age
+
+    # Assets with a balance
+    def held_assets(self):
+        with self._lock:
+            return list(self.positions)
+
+    # Assets with a balance but without known price
+    def unpriced_assets(self):
+        with self._lock:
+            return [asset for asset in self.positions if asset not in self.prices]
+
+    # Replace all positions with the given balance (as returned by Kraken's 'Balance')
+    def set_positions(self, balance):
+        with self._lock:
+            for asset in list(self.positions):
+                if asset not in balance:
+                    self._set(asset, 0.0, self.prices.get(asset))
+
+            for asset, amount in balance.items():
+                self._set(asset, float(amount), self.prices.get(asset))
+
+            # Fresh sum of all values to get rid of accumulated rounding errors
+            self.total = sum(self.values.values())
+            self._loaded_at = time.time()
+
+    def update_price(self, asset, price):
+        with self._lock:
+            self._set(asset, self.positions.get(asset, 0.0), float(price))
+
+    # Return value of every asset (biggest first) together with the total value and, if
+    # 'commit' is True, remember them as new snapshot. Values are tuples of asset, amount,
+    # value (or None if no price is known), allocation in percent and change since last snapshot
+    def snapshot(self, commit=True):
+        with self._lock:
+            breakdown = list()
+
+            for asset, amount in self.positions.items():
+                value = self.values.get(asset)
+
+                if value is None:
+                    breakdown.append((asset, amount, None, None, None))
+                    continue
+
+                allocation = value / self.total * 100 if self.total else 0.0
+                change = None
+                if self.last_values is not None:
+                    change = value - self.last_values.get(asset, 0.0)
+
+                breakdown.append((asset, amount, value, allocation, change))
+
+            total_change = None
+            if self.last_total is not None:
+                total_change = self.total - self.last_total
+
+            if commit:
+                self.last_values = dict(self.values)
+                self.last_total = self.total
+
+            breakdown.sort(key=lambda item: -1 if item[2] is None else item[2], reverse=True)
+            return breakdown, self.total, total_change
+
+    # Set amount and price of an asset and apply the difference to the total value
+    def _set(self, asset, amount, price):
+        if amount:
+            self.positions[asset] = amount
+        else:
+            self.positions.pop(asset, None)
+
+        if price is not None:
+            self.prices[asset] = price
+
+        old_value = self.values.pop(asset, 0.0)
+
+        if amount and price is not None:
+            self.values[asset] = amount * price
+
+        self.total += self.values.get(asset, 0.0) - old_value